@@ -1,18 +1,36 @@
 """Application Entry Point"""
 
 from argparse import ArgumentParser, Namespace
-from asyncio import get_running_loop, run
-from functools import partial
+from asyncio import Event as AsyncEvent
+from asyncio import CancelledError, Queue, Task
+from asyncio import TimeoutError as AsyncTimeoutError
+from asyncio import create_task, get_running_loop, run, shield, sleep, wait_for
+from contextlib import suppress
+from functools import cache, lru_cache, partial, wraps
+from importlib.resources import files
+from itertools import islice
 from json import dump, load
 from logging import ERROR, INFO, NOTSET, basicConfig, getLogger
-from threading import Event, Lock
-from typing import Callable, List
-from urllib.parse import urlparse, ParseResult
+from re import compile as re_compile
+from signal import SIGINT, SIGTERM
+from threading import Event
+from typing import Callable, Dict, FrozenSet, List, Optional
+from urllib.parse import parse_qs, urlparse, ParseResult
 from os.path import exists
-
-from decorator import decorator
-
-from twitchAPI.chat import Chat, ChatCommand, ChatMessage, ChatUser, JoinedEvent
+from pathlib import Path
+
+import aiofiles
+import orjson
+from symspellpy import SymSpell, Verbosity
+
+from twitchAPI.chat import (
+    Chat,
+    ChatCommand,
+    ChatMessage,
+    ChatUser,
+    EventData,
+    JoinedEvent,
+)
 from twitchAPI.oauth import UserAuthenticator
 from twitchAPI.twitch import Twitch
 from twitchAPI.helper import first
@@ -35,9 +53,22 @@ API_SCOPES = [
     AuthScope.USER_BOT,
     AuthScope.CHANNEL_MANAGE_REDEMPTIONS,
 ]
-# SPELLCHECKER = SpellChecker()
-IGNORE_USERS = []
-IGNORE_USERS_LCK = Lock()
+# Apostrophes are kept since the dictionary spells out contractions, with
+# curly ones from phone keyboards normalised to straight ones
+APOSTROPHE_TABLE = str.maketrans("‘’", "''")
+WORD_SEPARATOR = re_compile(r"[^\w']+")
+# Replaced rather than mutated, so readers on other threads always see a
+# consistent snapshot without taking a lock
+IGNORE_USERS: FrozenSet[str] = frozenset()
+MESSAGE_BATCH_WINDOW = 0.1
+MESSAGE_BATCH_SIZE = 32
+MESSAGE_QUEUE: Optional[Queue] = None
+SPELLCHECK_TASK: Optional[Task] = None
+MAX_CORRECTIONS = 5
+MAX_CORRECTIONS_LENGTH = 400
+GREETING = "📎 Hi, my name is {name}, I'm here to help. :) 📎"
+# Set from amain's thread and toggled from the chat thread, so this has to be a
+# thread-safe threading.Event rather than an asyncio.Event
 BOT_ENABLE = Event()
 
 
@@ -51,27 +82,242 @@ def load_ignore_users(cfg_path: str) -> List[str]:
     :rtype: List[str]
     """
     try:
-        with open(cfg_path, "r", encoding="utf-8") as file:
-            data = load(file)
-            ignored_users = data.get("ignore-users")
-            return [] if ignored_users is None else ignored_users
+        data = orjson.loads(Path(cfg_path).read_bytes())
+        ignored_users = data.get("ignore-users")
+        return [] if ignored_users is None else ignored_users
     except FileNotFoundError:
         LOG.warning("No config found: %s", cfg_path)
         return []
 
 
-def save_ignore_users(cfg_path: str, ignore_users: List[str] = []) -> None:
+async def save_ignore_users(
+    cfg_path: str, ignore_users: FrozenSet[str] = frozenset()
+) -> None:
     """
     Save the list of ignored users to file.
 
     :param cfg_path: Path to config file.
     :type cfg_path: str
-    :param ignore_users: list of user id's to ignore, defaults to []
-    :type ignore_users: List[str], optional
+    :param ignore_users: set of user id's to ignore, defaults to frozenset()
+    :type ignore_users: FrozenSet[str], optional
+    """
+    data = {"ignore-users": list(ignore_users)}
+    async with aiofiles.open(cfg_path, "wb+") as file:
+        await file.write(orjson.dumps(data))
+
+
+async def flush_ignore_users(
+    cfg_path: str, changes: Queue, delay: float = 5.0
+) -> None:
+    """
+    Save the ignored users to file whenever they change, coalescing bursts of
+    changes into a single write of the latest snapshot.
+
+    :param cfg_path: Path to config file.
+    :type cfg_path: str
+    :param changes: Queue of ignored user snapshots, one per change
+    :type changes: Queue
+    :param delay: Seconds to wait for further changes before saving, defaults to 5.0
+    :type delay: float, optional
+    """
+    while True:
+        ignore_users = await changes.get()
+        await sleep(delay)
+        while not changes.empty():
+            ignore_users = changes.get_nowait()
+        # Let a save that has started finish even if cancelled, so it cannot
+        # overlap with the final save on shutdown
+        save = create_task(save_ignore_users(cfg_path, ignore_users))
+        try:
+            await shield(save)
+        except CancelledError:
+            with suppress(OSError):
+                await save
+            raise
+        except OSError:
+            LOG.exception("Failed to save ignored users to %s", cfg_path)
+
+
+@cache
+def get_spellchecker() -> SymSpell:
+    """
+    Load the spellchecker dictionary, once per process.
+
+    :return: Spellchecker loaded with the bundled English dictionary
+    :rtype: SymSpell
+    """
+    spellchecker = SymSpell(max_dictionary_edit_distance=2, prefix_length=7)
+    spellchecker.load_dictionary(
+        str(files("symspellpy") / "frequency_dictionary_en_82_765.txt"),
+        term_index=0,
+        count_index=1,
+    )
+    return spellchecker
+
+
+@cache
+def get_known_words() -> FrozenSet[str]:
+    """
+    Get every word in the spellchecker dictionary.
+
+    :return: Known words
+    :rtype: FrozenSet[str]
+    """
+    return frozenset(get_spellchecker().words)
+
+
+def is_link_or_emote(word: str) -> bool:
+    """
+    Check if a chat token is a link, an @mention or looks like a Twitch emote
+    (short and all-caps), none of which are worth spellchecking.
+
+    :param word: Raw token from a chat message
+    :type word: str
+    :return: Whether the token should be skipped
+    :rtype: bool
+    """
+    return (
+        word.startswith("http")
+        or word.startswith("@")
+        or (len(word) <= 8 and word.isupper())
+    )
+
+
+@lru_cache(maxsize=8192)
+def spell_correction(word: str) -> Optional[str]:
+    """
+    Find the most likely correction for a misspelled word.
+
+    :param word: Lowercased word to correct
+    :type word: str
+    :return: The suggested correction, or None if there is no close match
+    :rtype: Optional[str]
+    """
+    suggestions = get_spellchecker().lookup(
+        word, Verbosity.TOP, max_edit_distance=2, include_unknown=False
+    )
+    if len(suggestions) == 0:
+        return None
+    return suggestions[0].term
+
+
+@lru_cache(maxsize=1)
+def greeting(name: str) -> str:
+    """
+    Build the chat greeting for the bot user.
+
+    :param name: Bot's Twitch user name
+    :type name: str
+    :return: Greeting message
+    :rtype: str
+    """
+    return GREETING.format(name=name)
+
+
+def tokenize_message(text: str) -> List[str]:
+    """
+    Split a chat message into normalised words worth spellchecking.
+
+    :param text: Raw chat message text
+    :type text: str
+    :return: Lowercased words, without links, mentions, emotes or numbers
+    :rtype: List[str]
+    """
+    words = [w for w in text.split() if not is_link_or_emote(w)]
+    text = " ".join(words).lower().translate(APOSTROPHE_TABLE)
+    words = (w.strip("'") for w in WORD_SEPARATOR.split(text))
+    return [
+        w
+        for w in words
+        if any(c.isalpha() for c in w) and not any(c.isdigit() for c in w)
+    ]
+
+
+def format_corrections(
+    misspelled: List[str], corrections: Dict[str, Optional[str]]
+) -> str:
+    """
+    Describe the corrections for a message, capped so the reply stays within
+    Twitch's chat message length.
+
+    :param misspelled: Misspelled words in the order they appear
+    :type misspelled: List[str]
+    :param corrections: Suggested correction for each misspelled word
+    :type corrections: Dict[str, Optional[str]]
+    :return: Comma separated corrections, or an empty string if there are none
+    :rtype: str
+    """
+    parts = []
+    length = 0
+    for word in islice(
+        (w for w in misspelled if corrections[w] is not None), MAX_CORRECTIONS
+    ):
+        part = f'{word} (did you mean "{corrections[word]}"?)'
+        length += len(part) + 2
+        if length > MAX_CORRECTIONS_LENGTH:
+            break
+        parts.append(part)
+    return ", ".join(parts)
+
+
+async def spellcheck_batch(batch: List[ChatMessage]) -> None:
+    """
+    Spellcheck a batch of chat messages, looking up each distinct word once,
+    and reply to every message that has corrections.
+
+    :param batch: Chat messages to spellcheck
+    :type batch: List[ChatMessage]
+    """
+    known_words = get_known_words()
+    tokenized = [(message, tokenize_message(message.text)) for message in batch]
+    misspelled = {
+        w for _, words in tokenized for w in words if w not in known_words
+    }
+    corrections = {w: spell_correction(w) for w in misspelled}
+
+    for message, words in tokenized:
+        message_misspelled = list(
+            dict.fromkeys(w for w in words if w in corrections)
+        )
+        LOG.info(
+            "Found %s potential errors in message from %s: %s",
+            len(message_misspelled),
+            message.user.display_name,
+            message.text,
+        )
+        message_corrections = format_corrections(message_misspelled, corrections)
+        if len(message_corrections) == 0:
+            continue
+        await message.reply(
+            f"📎 Uh-oh, looks like you misspelled {message_corrections}"
+            " Would you like help with that? 📎"
+        )
+
+
+async def spellcheck_messages(queue: Queue) -> None:
+    """
+    Drain chat messages from the queue, spellchecking everything that arrives
+    within a short window as one batch.
+
+    :param queue: Queue of chat messages to spellcheck
+    :type queue: Queue
     """
-    with open(cfg_path, "w+", encoding="utf-8") as file:
-        data = {"ignore-users": ignore_users}
-        dump(data, file)
+    loop = get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + MESSAGE_BATCH_WINDOW
+        while len(batch) < MESSAGE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await wait_for(queue.get(), timeout))
+            except AsyncTimeoutError:
+                break
+        try:
+            await spellcheck_batch(batch)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOG.exception("Failed to spellcheck batch of %s messages", len(batch))
 
 
 def parse_args() -> Namespace:
@@ -128,105 +374,54 @@ def parse_args() -> Namespace:
     return parser.parse_args()
 
 
-@decorator
-async def bot_enabled(func: Callable, event: any, *args, **kwargs) -> any:
+def bot_enabled(func: Callable) -> Callable:
     """
     Decorator to check for bot-enabled status on handlers
 
     :param func: Decorated handler to call
     :type func: Callable
-    :param event: Event payload from the handler
-    :type event: any
-    :raises RuntimeError: _description_
-    :return: The return value of the handler function
-    :rtype: any
+    :return: The wrapped handler
+    :rtype: Callable
     """
-    if not BOT_ENABLE.is_set():
-        raise RuntimeError(f"Cannot run {func} because bot is disabled!")
-    return await func(event, *args, **kwargs)
 
+    @wraps(func)
+    async def wrapper(event: any, *args, **kwargs) -> any:
+        if not BOT_ENABLE.is_set():
+            raise RuntimeError(f"Cannot run {func} because bot is disabled!")
+        return await func(event, *args, **kwargs)
+
+    return wrapper
 
-@decorator
-async def user_is_mod(func: Callable, event: any, *args, **kwargs) -> any:
+
+def user_is_mod(func: Callable) -> Callable:
     """
     Decorator to check for user-mod status status on handlers
 
     :param func: Decorated handler to call
     :type func: Callable
-    :param event: Event payload from the handler
-    :type event: any
-    :raises RuntimeError: _description_
-    :return: The return value of the handler function
-    :rtype: any
-    """
-    if not hasattr(event, "user") or not isinstance(event.user, ChatUser):
-        raise ValueError(
-            f"Cannot use @user_is_mod on {func} because event type"
-            f" {type(event)} does not have a ChatUser payload!"
-        )
-    user: ChatUser = event.user
-    if (
-        (user.badges is not None) and (user.badges.get("broadcaster") is not None)
-    ) or user.mod:
-        return await func(event, *args, **kwargs)
-    await event.reply("You must be a mod to use that command!")
-    raise RuntimeError(
-        f"Cannot run {func} because ChatUser {user.display_name} is not a mod!"
-    )
-
-
-@decorator
-async def user_not_ignored(func: Callable, event: any, *args, **kwargs) -> any:
+    :return: The wrapped handler
+    :rtype: Callable
     """
-    Decorator to check for user-ignored status on handlers
 
-    :param func: Decorated handler to call
-    :type func: Callable
-    :param event: Event payload from the handler
-    :type event: any
-    :raises RuntimeError: _description_
-    :return: The return value of the handler function
-    :rtype: any
-    """
-    if not hasattr(event, "user") or not isinstance(event.user, ChatUser):
-        raise ValueError(
-            f"Cannot use @user_not_ignored on {func} because event type"
-            f" {type(event)} does not have a ChatUser payload!"
-        )
-    user: ChatUser = event.user
-    if user.id in IGNORE_USERS:
+    @wraps(func)
+    async def wrapper(event: any, *args, **kwargs) -> any:
+        if not hasattr(event, "user") or not isinstance(event.user, ChatUser):
+            raise ValueError(
+                f"Cannot use @user_is_mod on {func} because event type"
+                f" {type(event)} does not have a ChatUser payload!"
+            )
+        user: ChatUser = event.user
+        if (
+            (user.badges is not None)
+            and (user.badges.get("broadcaster") is not None)
+        ) or user.mod:
+            return await func(event, *args, **kwargs)
+        await event.reply("You must be a mod to use that command!")
         raise RuntimeError(
-            f"Cannot run {func} because ChatUser {user.display_name}"
-            " requested to be ignored!"
+            f"Cannot run {func} because ChatUser {user.display_name} is not a mod!"
         )
 
-    return await func(event, *args, **kwargs)
-
-
-@decorator
-async def not_command(func: Callable, message: ChatMessage, *args, **kwargs) -> any:
-    """
-    Decorator to check for command in message on handlers
-
-    :param func: Decorated handler to call
-    :type func: Callable
-    :param event: Event payload from the handler
-    :type event: any
-    :raises RuntimeError: _description_
-    :return: The return value of the handler function
-    :rtype: any
-    """
-    if not isinstance(message, ChatMessage):
-        raise ValueError(
-            f"Cannot use @not_command on {func} because event type {type(message)}"
-            " is not a ChatMessage payload!"
-        )
-    if message.text.startswith("!"):
-        LOG.warning(
-            "Skipping %s because %s appears to be a command!", func, message.text
-        )
-        return
-    return await func(message, *args, **kwargs)
+    return wrapper
 
 
 async def on_join(event: JoinedEvent) -> None:
@@ -237,10 +432,25 @@ async def on_join(event: JoinedEvent) -> None:
     """
     await event.chat.send_message(
         room=event.room_name,
-        text=f"📎 Hi, my name is {event.user_name}, I'm here to help. :) 📎",
+        text=greeting(event.user_name),
     )
 
 
+async def on_ready(_event: EventData) -> None:
+    """
+    Handle Twitch chat ready event.
+
+    Starts the spellchecker on the chat thread's event loop, where chat
+    messages are handled and replies are sent.
+
+    :param _event: Ready event payload
+    :type _event: EventData
+    """
+    global MESSAGE_QUEUE, SPELLCHECK_TASK
+    MESSAGE_QUEUE = Queue()
+    SPELLCHECK_TASK = create_task(spellcheck_messages(MESSAGE_QUEUE))
+
+
 def on_point_redeem(event: ChannelPointsCustomRewardRedemptionAddEvent) -> None:
     """
     Handle Twitch channel point redeem.
@@ -252,40 +462,26 @@ def on_point_redeem(event: ChannelPointsCustomRewardRedemptionAddEvent) -> None:
     LOG.info(data.to_dict())
 
 
-@bot_enabled
-@not_command
-@user_not_ignored
 async def on_message(message: ChatMessage) -> None:
     """
     Handle twitch messages
 
+    Skips messages while the bot is disabled, commands, ignored users and
+    messages with nothing to spellcheck.
+
     :param message: Twitch chat message payload
     :type message: ChatMessage
     """
-    message_words = message.text.split(" ")
-    # misspelled = SPELLCHECKER.unknown(message_words)
-    # misspelled_cnt = len(misspelled)
-    # LOG.info(
-    #     "Found %s potential errors in message from %s: %s",
-    #     misspelled_cnt,
-    #     message.user.display_name,
-    #     message.text,
-    # )
-
-    # if misspelled_cnt > 0:
-    #     corrections = []
-    #     for word in misspelled:
-    #         correction = SPELLCHECKER.correction(word)
-    #         if correction is None:
-    #             continue
-    #         corrections.append(f'{word} (did you mean "{correction}"?)')
-    #     corrections = ", ".join(corrections)
-    #     if len(corrections) == 0:
-    #         return
-    #     await message.reply(
-    #         f"📎 Uh-oh, looks like you misspelled {corrections}"
-    #         " Would you like help with that? 📎"
-    #     )
+    text = message.text
+    if (
+        not BOT_ENABLE.is_set()
+        or MESSAGE_QUEUE is None
+        or text[:1] == "!"
+        or message.user.id in IGNORE_USERS
+        or not any(c.isalpha() for c in text)
+    ):
+        return
+    MESSAGE_QUEUE.put_nowait(message)
 
 
 @bot_enabled
@@ -339,40 +535,47 @@ async def on_list(cmd: ChatCommand, twitch: Twitch) -> None:
     :param cmd: Twitch chat command payload
     :type cmd: ChatCommand
     """
-    IGNORE_USERS_LCK.acquire()
-    users_from_ids = [i async for i in twitch.get_users(IGNORE_USERS)]
-    IGNORE_USERS_LCK.release()
-    msg_part = ", ".join(list(map(lambda x: x.display_name, users_from_ids)))
+    ignore_users = IGNORE_USERS
+    users_from_ids = [i async for i in twitch.get_users(list(ignore_users))]
+    msg_part = ", ".join(u.display_name for u in users_from_ids)
     await cmd.reply(f"Ignored users: {msg_part}")
 
 
 @bot_enabled
-async def on_ignore(cmd: ChatCommand) -> None:
+async def on_ignore(
+    cmd: ChatCommand, on_change: Callable[[FrozenSet[str]], None]
+) -> None:
     """
     Handle ignore command
 
     :param cmd: Twitch chat command payload
     :type cmd: ChatCommand
+    :param on_change: Callback handed each new snapshot of the ignored users
+    :type on_change: Callable[[FrozenSet[str]], None]
     """
+    global IGNORE_USERS
     LOG.info("Got ignore request for user: %s", cmd.user.display_name)
-    IGNORE_USERS_LCK.acquire()
-    IGNORE_USERS.append(cmd.user.id)
-    IGNORE_USERS_LCK.release()
+    IGNORE_USERS = IGNORE_USERS | {cmd.user.id}
+    on_change(IGNORE_USERS)
     await cmd.reply("📎 Ok! I won't bother you anymore! :) 📎")
 
 
 @bot_enabled
-async def on_listen(cmd: ChatCommand) -> None:
+async def on_listen(
+    cmd: ChatCommand, on_change: Callable[[FrozenSet[str]], None]
+) -> None:
     """
     Handle listen command
 
     :param cmd: Twitch chat command payload
     :type cmd: ChatCommand
+    :param on_change: Callback handed each new snapshot of the ignored users
+    :type on_change: Callable[[FrozenSet[str]], None]
     """
+    global IGNORE_USERS
     LOG.info("Got unignore request for user: %s", cmd.user.display_name)
-    IGNORE_USERS_LCK.acquire()
-    IGNORE_USERS.remove(cmd.user.id)
-    IGNORE_USERS_LCK.release()
+    IGNORE_USERS = IGNORE_USERS - {cmd.user.id}
+    on_change(IGNORE_USERS)
     await cmd.reply(
         "📎 Ok! I'll be sure to suggest corrections for you again! :) 📎"
     )
@@ -400,8 +603,7 @@ async def amain():
         with open(AUTH_PATH, "r", encoding="utf-8") as file:
             res = load(file)
             url_bits: ParseResult = urlparse(res["app-url"])
-            auth_args = url_bits.query.split("&")
-            auth_args = dict(map(lambda x: x.split("="), auth_args))
+            auth_args = {k: v[0] for k, v in parse_qs(url_bits.query).items()}
     else:
         auth_url = auth.return_auth_url()
         print(
@@ -443,7 +645,7 @@ async def amain():
         rewards: List[CustomReward] = [
             r async for r in twitch.get_custom_reward(broadcaster.id)
         ]
-        rewards = list(filter(lambda x: "clippy" in x.title.lower(), rewards))
+        rewards = [r for r in rewards if "clippy" in r.title.lower()]
         if len(rewards) == 0:
             raise TwitchAPIException(
                 "No rewards for Clippy were found on"
@@ -459,40 +661,55 @@ async def amain():
         LOG.error("Failed to create channel point reward with reason: %s", e)
 
     # Load ignored users cfg
-    IGNORE_USERS_LCK.acquire()
-    IGNORE_USERS = load_ignore_users(args.ignore_users)
-    IGNORE_USERS_LCK.release()
+    IGNORE_USERS = frozenset(load_ignore_users(args.ignore_users))
+    loop = get_running_loop()
+    ignore_users_changes = Queue()
+    # Handlers run on the chat thread, so hand snapshots back onto this loop
+    on_ignore_change = partial(
+        loop.call_soon_threadsafe, ignore_users_changes.put_nowait
+    )
+
+    # Load spellchecker dictionary before any messages arrive
+    get_known_words()
 
     # Setup Chat Bot
     chat = await Chat(twitch=twitch, initial_channel=[args.twitch_channel])
+    chat.register_event(ChatEvent.READY, on_ready)
     chat.register_event(ChatEvent.JOINED, on_join)
     chat.register_event(ChatEvent.MESSAGE, on_message)
     chat.set_prefix("!c ")
     chat.register_command("about", on_about)
 
     chat.register_command("list", partial(on_list, twitch=twitch))
-    chat.register_command("ignore", on_ignore)
-    chat.register_command("listen", on_listen)
+    chat.register_command("ignore", partial(on_ignore, on_change=on_ignore_change))
+    chat.register_command("listen", partial(on_listen, on_change=on_ignore_change))
 
     chat.register_command("enable", on_enable)
     chat.register_command("disable", on_disable)
 
     # Wait for exit signal and gracefully close
+    stop_event = AsyncEvent()
+    for signum in (SIGINT, SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+    flusher = create_task(
+        flush_ignore_users(args.ignore_users, ignore_users_changes)
+    )
     try:
         # Start the Chat Bot
         LOG.info("Joined Twitch chat -> https://twitch.tv/%s", args.twitch_channel)
         BOT_ENABLE.set()
         chat.start()
-        while True:
-            pass
+        await stop_event.wait()
     finally:
-        IGNORE_USERS_LCK.acquire()
-        save_ignore_users(args.ignore_users, IGNORE_USERS)
-        IGNORE_USERS_LCK.release()
-
+        # Handlers only run on the chat thread, so stop it before saving
+        if SPELLCHECK_TASK is not None:
+            SPELLCHECK_TASK.get_loop().call_soon_threadsafe(SPELLCHECK_TASK.cancel)
         chat.stop()
+        flusher.cancel()
+        with suppress(CancelledError):
+            await flusher
+        await save_ignore_users(args.ignore_users, IGNORE_USERS)
         await twitch.close()
-        get_running_loop().close()
 
 
 def main():